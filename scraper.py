@@ -1,43 +1,129 @@
 import asyncio
 import csv
+import io
 import logging
+import os
 import re
 import random
 import time
 from datetime import datetime
+from urllib.parse import urlparse
 from playwright.async_api import async_playwright, TimeoutError
 
+try:
+    from selectolax.parser import HTMLParser
+except ImportError:
+    HTMLParser = None
+
+try:
+    import zstandard as zstd
+except ImportError:
+    zstd = None
+
+try:
+    import uvloop
+except ImportError:
+    uvloop = None
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = pq = None
+
+_PAGE_RE = re.compile(r"[?&]page=(\d+)")
+_COMPANY_FIELDS = ("name", "location", "revenue", "employees")
+_CSV_HEADER = _COMPANY_FIELDS + ("timestamp",)
+_PARQUET_SCHEMA = pa.schema(
+    [(field, pa.string()) for field in _COMPANY_FIELDS] + [("timestamp", pa.timestamp('s'))]
+) if pa is not None else None
+_USER_AGENT = (
+    "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 "
+    "(KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36"
+)
+_MAX_PROBE_PAGES = 1024
+_PROBE_ATTEMPTS = 3
+_ITEM_CLASS_RE = re.compile(r"""(?<![\w-])class\s*=\s*(["'])[^"']*(?<![\w-])company-item(?![\w-])[^"']*\1""")
+_BLOCKED_RESOURCE_TYPES = frozenset({"image", "font", "media", "stylesheet"})
+_BLOCKED_HOSTS = ("google-analytics.com", "googletagmanager.com", "doubleclick.net", "facebook.net")
+
+
 class WebScraper:
-    def __init__(self, url, output_file, delay_range=(1, 3)):
+    def __init__(self, url, output_file, delay_range=(1, 3), wait_selector=".company-item", concurrency=8,
+                 javascript_enabled=True, probe_pages=False, compress=False, output_format="csv",
+                 row_group_size=1024, append=False, http_fast_path=True):
+        if output_format not in ("csv", "parquet"):
+            raise ValueError(f"Unsupported output format: {output_format}")
+        if append and output_format != "csv":
+            raise ValueError("append=True is only supported for CSV output")
+        if compress and output_format != "csv":
+            raise ValueError("compress=True applies to CSV output only; Parquet output is always zstd-compressed")
+        if compress and zstd is None:
+            raise ImportError("compress=True requires the zstandard package")
+        if output_format == "parquet" and pa is None:
+            raise ImportError("output_format='parquet' requires the pyarrow package")
         self.url = url
-        self.output_file = output_file
+        self.output_file = f"{output_file}.zst" if compress else output_file
+        self.compress = compress
+        self.output_format = output_format
+        self.row_group_size = row_group_size
+        self.append = append
         self.delay_range = delay_range
+        self.wait_selector = wait_selector
+        self.concurrency = concurrency
+        self.javascript_enabled = javascript_enabled
+        self.probe_pages = probe_pages
+        self.http_fast_path = http_fast_path and HTMLParser is not None
+        self._csv_fp = None
+        self._csv_writer = None
+        self._parquet_writer = None
+        self._parquet_rows = []
+        self._owns_browser = True
+        self._throttle_lock = None
+        self._next_request_at = 0.0
         self.setup_logger()
         
     def setup_logger(self):
         logging.basicConfig(
             filename=f'scraping_{datetime.now().strftime("%Y%m%d_%H%M%S")}.log',
             level=logging.INFO,
-            format='%(asctime)s - %(levelname)s - %(message)s'
+            # Epoch seconds avoid a strftime call per record; convert offline if needed
+            format='%(created).3f - %(levelname)s - %(message)s'
         )
         self.logger = logging.getLogger()
         
-    async def initialize_browser(self):
-        self.playwright = await async_playwright().start()
-        self.browser = await self.playwright.chromium.launch(headless=True)
+    async def initialize_browser(self, browser=None):
+        # A shared browser is owned by the caller; only launch (and later close) one of our own if none is given
+        self._owns_browser = browser is None
+        if self._owns_browser:
+            self.playwright = await async_playwright().start()
+            self.browser = await self.playwright.chromium.launch(headless=True)
+        else:
+            self.browser = browser
         self.context = await self.browser.new_context(
-            user_agent="Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36"
+            user_agent=_USER_AGENT,
+            java_script_enabled=self.javascript_enabled
         )
-        self.page = await self.context.new_page()
+        await self.context.route("**/*", self.block_assets)
         self.logger.info(f"Browser initialized for {self.url}")
         
-    async def navigate_to_url(self, url=None, timeout=30000):
+    async def block_assets(self, route):
+        request = route.request
+        host = urlparse(request.url).hostname or ""
+        if request.resource_type in _BLOCKED_RESOURCE_TYPES or host.endswith(_BLOCKED_HOSTS):
+            await route.abort()
+        else:
+            await route.continue_()
+        
+    async def navigate_to_url(self, page, url=None, timeout=30000):
         target_url = url or self.url
         try:
-            response = await self.page.goto(target_url, timeout=timeout, wait_until="networkidle")
+            response = await page.goto(target_url, timeout=timeout, wait_until="domcontentloaded")
             if response.status >= 400:
                 self.logger.error(f"Failed to navigate to {target_url}: HTTP {response.status}")
                 return False
+            if self.wait_selector:
+                await page.wait_for_selector(self.wait_selector, state="attached", timeout=timeout)
             self.logger.info(f"Successfully navigated to {target_url}")
             return True
         except TimeoutError:
@@ -47,49 +133,102 @@ class WebScraper:
             self.logger.error(f"Failed to navigate to {target_url}: {str(e)}")
             return False
             
-    async def get_total_pages(self):
+    async def get_total_pages(self, page):
         try:
-            page_links = await self.page.query_selector_all("a[href*='?page=']")
-            pages = []
-            for link in page_links:
-                href = await link.get_attribute("href")
-                match = re.search(r"\?page=(\d+)", href)
-                if match:
-                    pages.append(int(match.group(1)))
-            if pages:
-                return max(pages)
-            return 1
+            # Compute the highest page number in the browser so only a single int crosses the wire
+            return await page.eval_on_selector_all("a[href*='page=']", """(els, pattern) => {
+                const re = new RegExp(pattern);
+                let last = 1;
+                for (const e of els) {
+                    const match = (e.getAttribute('href') || '').match(re);
+                    if (match) last = Math.max(last, +match[1]);
+                }
+                return last;
+            }""", _PAGE_RE.pattern)
         except Exception as e:
             self.logger.error(f"Failed to get total pages: {str(e)}")
             return 1
             
-    async def random_delay(self):
-        delay = random.uniform(*self.delay_range)
-        self.logger.debug(f"Waiting for {delay:.2f} seconds")
-        await asyncio.sleep(delay)
+    async def _page_has_items(self, page_number):
+        url = self.page_url(page_number)
+        for attempt in range(1, _PROBE_ATTEMPTS + 1):
+            await self.throttle()
+            try:
+                response = await self.context.request.get(url)
+            except Exception as e:
+                self.logger.warning(f"Failed to probe {url} (attempt {attempt}): {str(e)}")
+                continue
+            try:
+                # Only a 404 or a successful page without items counts as a miss; anything else is retried
+                if response.status == 404:
+                    return False
+                if not response.ok:
+                    self.logger.warning(f"Failed to probe {url} (attempt {attempt}): HTTP {response.status}")
+                    continue
+                html = await response.text()
+                if HTMLParser is not None:
+                    return HTMLParser(html).css_first(".company-item") is not None
+                return _ITEM_CLASS_RE.search(html) is not None
+            finally:
+                await response.dispose()
+        raise RuntimeError(f"Could not probe {url} after {_PROBE_ATTEMPTS} attempts")
             
-    async def extract_data(self):
+    async def discover_last_page(self, max_pages=None, fallback=1):
         try:
-            companies = await self.page.query_selector_all(".company-item")
-            results = []
-            for company in companies:
-                name_elem = await company.query_selector(".name")
-                location_elem = await company.query_selector(".location")
-                revenue_elem = await company.query_selector(".revenue")
-                employees_elem = await company.query_selector(".employees")
-                
-                name = await name_elem.inner_text() if name_elem else "N/A"
-                location = await location_elem.inner_text() if location_elem else "N/A"
-                revenue = await revenue_elem.inner_text() if revenue_elem else "N/A"
-                employees = await employees_elem.inner_text() if employees_elem else "N/A"
-                
-                results.append({
-                    "name": name.strip(),
-                    "location": location.strip(),
-                    "revenue": revenue.strip(),
-                    "employees": employees.strip(),
-                    "timestamp": datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-                })
+            last_page = await self._probe_last_page(max_pages)
+        except RuntimeError as e:
+            self.logger.warning(f"{str(e)}; using {fallback} pages from the pager")
+            return fallback
+        if last_page is None:
+            # Some sites serve the last page for any out-of-range number, so probing never finds a miss
+            self.logger.warning(f"Probing hit the {_MAX_PROBE_PAGES}-page cap; using {fallback} pages from the pager")
+            return fallback
+        if last_page < fallback:
+            self.logger.warning(f"Probed last page {last_page} is lower than the pager's {fallback}")
+        self.logger.info(f"Probed last page: {last_page}")
+        return last_page
+        
+    async def _probe_last_page(self, max_pages):
+        # Double until a page comes back empty, then bisect between the last hit and the first miss
+        limit = max_pages or _MAX_PROBE_PAGES
+        lo, hi = 1, 2
+        while True:
+            probe = min(hi, limit)
+            if probe <= lo:
+                return lo if max_pages else None
+            if not await self._page_has_items(probe):
+                hi = probe
+                break
+            lo, hi = probe, hi * 2
+            
+        while lo + 1 < hi:
+            mid = (lo + hi) // 2
+            if await self._page_has_items(mid):
+                lo = mid
+            else:
+                hi = mid
+        return lo
+            
+    async def throttle(self):
+        async with self._throttle_lock:
+            delay = self._next_request_at - time.monotonic()
+            if delay > 0:
+                if self.logger.isEnabledFor(logging.DEBUG):
+                    self.logger.debug(f"Waiting for {delay:.2f} seconds")
+                await asyncio.sleep(delay)
+            self._next_request_at = time.monotonic() + random.uniform(*self.delay_range)
+            
+    async def extract_data(self, page):
+        try:
+            companies = await page.evaluate("""fields =>
+                Array.from(document.querySelectorAll('.company-item')).map(c =>
+                    fields.map(f =>
+                        (c.querySelector('.' + f)?.innerText ?? 'N/A').replace(/\\s+/g, ' ').trim()
+                    )
+                )
+            """, list(_COMPANY_FIELDS))
+            timestamp = (time.strftime("%Y-%m-%d %H:%M:%S"),)
+            results = [tuple(company) + timestamp for company in companies]
             
             self.logger.info(f"Extracted {len(results)} companies")
             return results
@@ -97,30 +236,60 @@ class WebScraper:
             self.logger.error(f"Data extraction failed: {str(e)}")
             return []
             
-    def save_to_csv(self, data, mode='w'):
+    async def extract_via_http(self, url):
+        # Returns None when the request itself failed, so callers can tell it apart from a page with no items
+        try:
+            response = await self.context.request.get(url)
+        except Exception as e:
+            self.logger.warning(f"HTTP extraction failed for {url}: {str(e)}")
+            return None
+        try:
+            if not response.ok:
+                self.logger.warning(f"HTTP extraction failed for {url}: HTTP {response.status}")
+                return None
+            tree = HTMLParser(await response.text())
+            timestamp = time.strftime("%Y-%m-%d %H:%M:%S")
+            results = []
+            for node in tree.css(".company-item"):
+                elems = [node.css_first(f".{field}") for field in _COMPANY_FIELDS]
+                # Collapse all whitespace, matching the browser path, so both yield identical values
+                values = (" ".join(elem.text(separator=" ").split()) if elem else "N/A" for elem in elems)
+                results.append(tuple(values) + (timestamp,))
+            return results
+        except Exception as e:
+            self.logger.warning(f"HTTP extraction failed for {url}: {str(e)}")
+            return None
+        finally:
+            # Release the body held by the driver; otherwise it lives until the context closes
+            await response.dispose()
+            
+    def _ensure_writer(self):
+        if self._csv_fp is None:
+            mode = 'a' if self.append else 'w'
+            # An existing but empty file still needs a header when appending
+            need_header = (
+                mode == 'w' or not os.path.exists(self.output_file) or os.path.getsize(self.output_file) == 0
+            )
+            if self.compress:
+                # Appended zstd frames decompress as one concatenated stream
+                raw = open(self.output_file, mode + 'b', buffering=1 << 20)
+                stream = zstd.ZstdCompressor(level=3, threads=-1).stream_writer(raw)
+                self._csv_fp = io.TextIOWrapper(stream, encoding='utf-8', newline='', write_through=True)
+            else:
+                self._csv_fp = open(self.output_file, mode, newline='', encoding='utf-8', buffering=1 << 20)
+            self._csv_writer = csv.writer(self._csv_fp, quoting=csv.QUOTE_MINIMAL)
+            if need_header:
+                self._csv_writer.writerow(_CSV_HEADER)
+        return self._csv_writer
+            
+    def save_to_csv(self, data):
         try:
             if not data:
                 self.logger.warning("No data to save")
                 return False
                 
-            field_names = list(data[0].keys()) if data else []
-            
-            file_mode = mode
-            header = True
-            
-            # If appending and file exists, don't write header
-            if mode == 'a':
-                try:
-                    with open(self.output_file, 'r', newline='', encoding='utf-8') as f:
-                        header = False
-                except FileNotFoundError:
-                    header = True
-            
-            with open(self.output_file, file_mode, newline='', encoding='utf-8') as f:
-                writer = csv.DictWriter(f, fieldnames=field_names)
-                if header:
-                    writer.writeheader()
-                writer.writerows(data)
+            writer = self._ensure_writer()
+            writer.writerows(data)
                 
             self.logger.info(f"Data saved to {self.output_file} ({len(data)} records)")
             return True
@@ -128,75 +297,229 @@ class WebScraper:
             self.logger.error(f"Failed to save CSV: {str(e)}")
             return False
             
-    async def close(self):
-        await self.context.close()
-        await self.browser.close()
-        await self.playwright.stop()
-        self.logger.info("Browser closed")
+    def _write_row_group(self, rows):
+        if self._parquet_writer is None:
+            self._parquet_writer = pq.ParquetWriter(self.output_file, _PARQUET_SCHEMA, compression='zstd')
+        arrays = [pa.array(column, pa.string()) for column in zip(*rows)]
+        arrays[-1] = arrays[-1].cast(pa.timestamp('s'))
+        self._parquet_writer.write_batch(pa.RecordBatch.from_arrays(arrays, schema=_PARQUET_SCHEMA))
+        self.logger.info(f"Data saved to {self.output_file} ({len(rows)} records)")
         
-    async def run(self, max_pages=None):
-        self.logger.info("Starting web scraping job")
-        await self.initialize_browser()
-        
-        if await self.navigate_to_url():
-            total_pages = await self.get_total_pages()
-            if max_pages and max_pages < total_pages:
-                total_pages = max_pages
+    def save_to_parquet(self, data):
+        try:
+            if not data:
+                self.logger.warning("No data to save")
+                return False
                 
-            self.logger.info(f"Found {total_pages} total pages to scrape")
+            # Buffer rows so each row group holds exactly row_group_size rows rather than one page
+            self._parquet_rows.extend(data)
+            while len(self._parquet_rows) >= self.row_group_size:
+                self._write_row_group(self._parquet_rows[:self.row_group_size])
+                del self._parquet_rows[:self.row_group_size]
+            return True
+        except Exception as e:
+            self.logger.error(f"Failed to save Parquet: {str(e)}")
+            return False
             
-            all_data = []
-            for page in range(1, total_pages + 1):
-                if page > 1:
-                    page_url = f"{self.url}{'&' if '?' in self.url else '?'}page={page}"
-                    success = await self.navigate_to_url(page_url)
+    def _close_writers(self):
+        if self._parquet_rows:
+            try:
+                self._write_row_group(self._parquet_rows)
+            except Exception as e:
+                self.logger.error(f"Failed to save Parquet: {str(e)}")
+            self._parquet_rows = []
+        if self._parquet_writer is not None:
+            self._parquet_writer.close()
+            self._parquet_writer = None
+        if self._csv_fp is not None:
+            # Closing the text wrapper flushes and closes the zstd stream and the raw file in turn
+            self._csv_fp.close()
+            self._csv_fp = None
+            self._csv_writer = None
+            
+    async def close(self):
+        try:
+            self._close_writers()
+        finally:
+            await self.context.close()
+            if self._owns_browser:
+                await self.browser.close()
+                await self.playwright.stop()
+                self.logger.info("Browser closed")
+            else:
+                self.logger.info("Browser context closed")
+        
+    def page_url(self, page_number):
+        return f"{self.url}{'&' if '?' in self.url else '?'}page={page_number}"
+        
+    async def write_results(self, queue):
+        while True:
+            data = await queue.get()
+            if data is None:
+                break
+            if self.output_format == "parquet":
+                self.save_to_parquet(data)
+            else:
+                self.save_to_csv(data)
+            queue.task_done()
+        
+    async def scrape_page(self, semaphore, queue, page_number, total_pages):
+        url = self.page_url(page_number)
+        async with semaphore:
+            data = None
+            slot_ready = False
+            if self.http_fast_path:
+                await self.throttle()
+                slot_ready = True
+                # Another page may have switched the fast path off while this one waited its turn
+                if self.http_fast_path:
+                    data = await self.extract_via_http(url)
+                    if data is None:
+                        # Don't follow a failed request (e.g. HTTP 429) with an immediate browser retry
+                        slot_ready = False
+                    elif not data:
+                        self.logger.info(
+                            f"No items found over HTTP on page {page_number}, using the browser from now on"
+                        )
+                        self.http_fast_path = False
+                        
+            if not data:
+                page = await self.context.new_page()
+                try:
+                    # An empty HTTP page already waited its turn; don't delay the fallback twice
+                    if not slot_ready:
+                        await self.throttle()
+                    success = await self.navigate_to_url(page, url)
                     if not success:
-                        self.logger.warning(f"Skipping page {page} due to navigation failure")
-                        continue
-                
-                data = await self.extract_data()
-                all_data.extend(data)
-                
-                self.logger.info(f"Extracted {len(data)} items from page {page}/{total_pages}")
+                        self.logger.warning(f"Skipping page {page_number} due to navigation failure")
+                        return
+                    
+                    data = await self.extract_data(page)
+                finally:
+                    await page.close()
+                    
+            self.logger.info(f"Extracted {len(data)} items from page {page_number}/{total_pages}")
+        
+        # Hand off to the writer as soon as the page is done to avoid data loss in case of errors
+        await queue.put(data)
+        
+    async def run(self, max_pages=None, browser=None):
+        self.logger.info("Starting web scraping job")
+        await self.initialize_browser(browser)
+        self._throttle_lock = asyncio.Lock()
+        
+        queue = asyncio.Queue(maxsize=2)
+        writer = asyncio.create_task(self.write_results(queue))
+        tasks = []
+        try:
+            page = await self.context.new_page()
+            try:
+                await self.throttle()
+                success = await self.navigate_to_url(page)
+                if success:
+                    total_pages = await self.get_total_pages(page)
+                    if self.probe_pages:
+                        total_pages = await self.discover_last_page(max_pages, fallback=total_pages)
+                    if max_pages and max_pages < total_pages:
+                        total_pages = max_pages
+                        
+                    self.logger.info(f"Found {total_pages} total pages to scrape")
+                    
+                    data = await self.extract_data(page)
+                    self.logger.info(f"Extracted {len(data)} items from page 1/{total_pages}")
+            finally:
+                await page.close()
                 
-                # Save incrementally to avoid data loss in case of errors
-                if page % 5 == 0 or page == total_pages:
-                    self.save_to_csv(all_data)
-                    all_data = []
+            if success:
+                await queue.put(data)
+                semaphore = asyncio.Semaphore(self.concurrency)
+                tasks = [
+                    asyncio.create_task(self.scrape_page(semaphore, queue, page_number, total_pages))
+                    for page_number in range(2, total_pages + 1)
+                ]
+                # Let every page finish (and hand its rows to the writer) before surfacing a failure
+                results = await asyncio.gather(*tasks, return_exceptions=True)
+                errors = [result for result in results if isinstance(result, BaseException)]
+                if errors:
+                    raise errors[0]
+        finally:
+            # No page task may outlive the context, e.g. when run() itself is cancelled
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            # Always drain the writer and close the output file, even on errors or cancellation
+            try:
+                await queue.put(None)
+                await writer
+            finally:
+                await self.close()
                 
-                if page < total_pages:
-                    await self.random_delay()
-            
-            # Save any remaining data
-            if all_data:
-                self.save_to_csv(all_data)
-                
-        await self.close()
         self.logger.info("Web scraping job completed")
 
 
 class ScraperManager:
     def __init__(self):
         self.scrapers = []
+        self._playwright = None
+        self._browser = None
         
-    def add_scraper(self, url, output_file, delay_range=(1, 3)):
-        scraper = WebScraper(url, output_file, delay_range)
+    def add_scraper(self, url, output_file, delay_range=(1, 3), wait_selector=".company-item", concurrency=8,
+                    javascript_enabled=True, probe_pages=False, compress=False, output_format="csv",
+                    row_group_size=1024, append=False, http_fast_path=True):
+        scraper = WebScraper(
+            url, output_file, delay_range=delay_range, wait_selector=wait_selector, concurrency=concurrency,
+            javascript_enabled=javascript_enabled, probe_pages=probe_pages, compress=compress,
+            output_format=output_format, row_group_size=row_group_size, append=append,
+            http_fast_path=http_fast_path
+        )
         self.scrapers.append(scraper)
         return scraper
         
+    async def _boot(self):
+        self._playwright = await async_playwright().start()
+        try:
+            self._browser = await self._playwright.chromium.launch(headless=True)
+        except BaseException:
+            await self._playwright.stop()
+            self._playwright = None
+            raise
+        
+    async def _shutdown(self):
+        await self._browser.close()
+        await self._playwright.stop()
+        self._browser = None
+        self._playwright = None
+        
     async def run_sequential(self):
-        for scraper in self.scrapers:
-            await scraper.run()
+        await self._boot()
+        try:
+            for scraper in self.scrapers:
+                await scraper.run(browser=self._browser)
+        finally:
+            await self._shutdown()
             
     async def run_concurrent(self):
-        tasks = [scraper.run() for scraper in self.scrapers]
-        await asyncio.gather(*tasks)
+        await self._boot()
+        try:
+            tasks = [scraper.run(browser=self._browser) for scraper in self.scrapers]
+            # Let every scraper finish and close its output before the shared browser goes away
+            results = await asyncio.gather(*tasks, return_exceptions=True)
+            errors = [result for result in results if isinstance(result, BaseException)]
+            for scraper, result in zip(self.scrapers, results):
+                if isinstance(result, BaseException):
+                    logging.getLogger().error(f"Scraper for {scraper.url} failed: {str(result)}")
+            if errors:
+                raise errors[0]
+        finally:
+            await self._shutdown()
         
     def run(self, concurrent=False):
+        # uvloop is a faster drop-in event loop; fall back to asyncio where it is unavailable (e.g. Windows)
+        run = uvloop.run if uvloop is not None else asyncio.run
         if concurrent:
-            return asyncio.run(self.run_concurrent())
+            return run(self.run_concurrent())
         else:
-            return asyncio.run(self.run_sequential())
+            return run(self.run_sequential())
 
 
 if __name__ == "__main__":